@@ -1,7 +1,7 @@
 """Install Operating Systems on VM images."""
 
+import argparse
 import logging
-from sysbuilder.image import VDI
 
 log = logging.getLogger(__name__)
 
@@ -9,7 +9,22 @@ log = logging.getLogger(__name__)
 def main():
     """Main."""
 
-    vdi = VDI(cfg_path="config.json")
+    parser = argparse.ArgumentParser(
+        prog="sysbuilder",
+        description="Install Operating Systems on VM images.",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        default="config.json",
+        help="Path to the JSON configuration file (default: config.json).",
+    )
+    args = parser.parse_args()
+
+    # Deferred so `--help` doesn't pay for importing the build machinery.
+    from sysbuilder.image import VDI  # pylint: disable=C0415
+
+    vdi = VDI(cfg_path=args.config)
     vdi.create()
     vdi.close()
 
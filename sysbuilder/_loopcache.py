@@ -0,0 +1,60 @@
+"""
+Map backing files to the loop devices they are attached to.
+
+The kernel publishes each loop device's backing file in sysfs, so the map is
+read straight from /sys/block/loop*/loop/backing_file without running
+losetup. The map is shared by everything in the process and reused until
+`invalidate` is called; anything that attaches or detaches a loop device
+must call it.
+"""
+
+import glob
+import threading
+from typing import Dict
+
+_LOOP_CACHE: Dict[str, str] | None = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _loop_map(force: bool = False) -> Dict[str, str]:
+    """Return the cached map, building it first if needed or `force`d."""
+
+    global _LOOP_CACHE  # pylint: disable=W0603
+
+    with _LOOP_LOCK:
+        if force or _LOOP_CACHE is None:
+            _LOOP_CACHE = {}
+            for backing_file in glob.glob(
+                "/sys/block/loop*/loop/backing_file"
+            ):
+                try:
+                    with open(backing_file, encoding="utf-8") as f:
+                        back_path = f.read().strip()
+                except FileNotFoundError:
+                    continue  # Detached since the glob.
+                _LOOP_CACHE[back_path] = "/dev/" + backing_file.split("/")[3]
+
+        return _LOOP_CACHE
+
+
+def get_loop_for(path: str) -> str | None:
+    """
+    Return the loop device backed by the file `path`, or None if it isn't
+    attached. The map is refreshed once on a miss in case something outside
+    sysbuilder attached it.
+    """
+
+    loopdev = _loop_map().get(path)
+    if loopdev is None:
+        loopdev = _loop_map(force=True).get(path)
+
+    return loopdev
+
+
+def invalidate() -> None:
+    """Drop the cached map after attaching or detaching loop devices."""
+
+    global _LOOP_CACHE  # pylint: disable=W0603
+
+    with _LOOP_LOCK:
+        _LOOP_CACHE = None
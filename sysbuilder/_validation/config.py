@@ -12,7 +12,11 @@ The configuration must contain at least the following top level keys:
 ## Storage (dict)
 
 The storage configuration must contain at least the following top level keys:
-['disk', 'layout'].
+['disk', 'layout'], but may also contain the keys ['fs_concurrency'].
+
+  - fs_concurrency (int): The maximum number of filesystems that will be
+    created at the same time, at least 1. Defaults to the number of partitions in
+    `layout` or 4, whichever is smaller.
 
 ### Disk
 
@@ -149,8 +153,10 @@ The required keys are ['base', and 'package_manager']
 
 """
 
+import json
+import re
+from functools import lru_cache
 from typing import Dict
-from jsonschema import validate
 from sysbuilder._validation.helpers import (
     type_bool,
     type_dict,
@@ -159,20 +165,46 @@ from sysbuilder._validation.helpers import (
     type_str,
 )
 
+_SIZE_RE = re.compile(r"\A[0-9]+[MGTP]\Z")
+_MODE_RE = re.compile(r"\A[0-2]?\d{3}\Z")
+_MP_RE = re.compile(r"\A(?:/|swap\Z)")
+
+# Leaf schemas shared by every property of that type. jsonschema only reads
+# them, and they have to stay plain dicts for its "object" checks.
+_STR = type_str()
+_STR_LIST = type_list(items=_STR)
+_BOOL = type_bool()
+_INT = type_int()
+
+
+def _is_disk_size(instance) -> bool:
+    """Sizes look like '10G'."""
+    return not isinstance(instance, str) or bool(_SIZE_RE.match(instance))
+
+
+def _is_file_mode(instance) -> bool:
+    """Modes look like '644' or '0644'."""
+    return not isinstance(instance, str) or bool(_MODE_RE.match(instance))
 
-def check(cfg: Dict) -> None:
-    """Check sysbuilder configuration data."""
+
+def _is_mountpoint(instance) -> bool:
+    """Mountpoints are absolute paths or 'swap'."""
+    return not isinstance(instance, str) or bool(_MP_RE.match(instance))
+
+
+def _build_schema() -> Dict:
+    """Build the configuration schema. Only called once, at import."""
 
     disk_schema = type_dict(
         properties={
             "ptable": type_str(enum=["gpt"]),
-            "path": type_str(),
-            "type": type_str(enum=["physical", "sparse", "raw"]),
-            "size": type_str(pattern=r"[0-9]+[MGTP]"),
+            "path": _STR,
+            "type": type_str(enum=["sparse", "raw", "physical"]),
+            "size": type_str(format="disk-size"),
         },
         required=[
-            "path",
             "ptable",
+            "path",
             "type",
         ],
     )
@@ -180,45 +212,45 @@ def check(cfg: Dict) -> None:
     install_schema = type_dict(
         properties={
             "base": type_str(enum=["archlinux"]),
-            "disable_root": type_bool(),
-            "late_commands": type_list(items=type_str()),
-            "locale": type_str(),
+            "disable_root": _BOOL,
+            "late_commands": _STR_LIST,
+            "locale": _STR,
             "package_manager": type_str(enum=["pacman"]),
-            "packages": type_list(items=type_str()),
+            "packages": _STR_LIST,
             "services": type_dict(
                 properties={
-                    "enabled": type_list(items=type_str()),
-                    "disabled": type_list(items=type_str()),
+                    "enabled": _STR_LIST,
+                    "disabled": _STR_LIST,
                 }
             ),
             "service_manager": type_str(enum=["systemd"]),
             "files": type_list(
                 items=type_dict(
                     properties={
-                        "src": type_str(),
-                        "dest": type_str(),
+                        "src": _STR,
+                        "dest": _STR,
                         "type": type_str(enum=["file", "directory", "link"]),
-                        "mode": type_str(pattern=r"[0-2]?\d{3}"),
-                        "owner": type_str(),
-                        "group": type_str(),
+                        "mode": type_str(format="file-mode"),
+                        "owner": _STR,
+                        "group": _STR,
                     },
-                    required=["src", "dest", "type"],
+                    required=["type", "src", "dest"],
                 )
             ),
-            "timezone": type_str(),
+            "timezone": _STR,
             "users": type_list(
                 items=type_dict(
                     properties={
-                        "name": type_str(),
-                        "gecos": type_str(),
+                        "name": _STR,
+                        "gecos": _STR,
                         "password": type_str(or_empty=True),
-                        "user_id": type_int(),
-                        "service_account": type_bool(),
-                        "additional_groups": type_list(items=type_str()),
-                        "shell": type_str(),
-                        "home_dir": type_str(),
-                        "create_home": type_bool(),
-                        "ssh_keys": type_list(items=type_str()),
+                        "user_id": _INT,
+                        "service_account": _BOOL,
+                        "additional_groups": _STR_LIST,
+                        "shell": _STR,
+                        "home_dir": _STR,
+                        "create_home": _BOOL,
+                        "ssh_keys": _STR_LIST,
                     },
                     required=["name"],
                 )
@@ -230,18 +262,20 @@ def check(cfg: Dict) -> None:
     layout_schema = type_list(
         items=type_dict(
             properties={
-                "start": type_str(),
-                "end": type_str(),
-                "typecode": type_str(),
+                "start": _STR,
+                "end": _STR,
+                "typecode": _STR,
                 "filesystem": type_dict(
                     properties={
-                        "type": type_str(),
-                        "mountpoint": type_str(pattern=r"^(/.*|swap)"),
-                        "label": type_str(),
-                        "label_flag": type_str(),
-                        "args": type_list(items=type_str()),
+                        "type": _STR,
+                        "mountpoint": type_str(format="mountpoint"),
+                        "label": _STR,
+                        "label_flag": _STR,
+                        "args": _STR_LIST,
+                        "reformat": _BOOL,
                     },
                     required=["type", "mountpoint"],
+                    additional_properties=False,
                 ),
             },
             required=["start", "end", "typecode", "filesystem"],
@@ -250,10 +284,14 @@ def check(cfg: Dict) -> None:
         maximum_item_count=128,
     )
 
-    schema = type_dict(
+    return type_dict(
         properties={
             "storage": type_dict(
-                properties={"disk": disk_schema, "layout": layout_schema},
+                properties={
+                    "disk": disk_schema,
+                    "fs_concurrency": type_int(minimum=1),
+                    "layout": layout_schema,
+                },
                 required=["disk", "layout"],
             ),
             "install": install_schema,
@@ -261,4 +299,47 @@ def check(cfg: Dict) -> None:
         required=["storage", "install"],
     )
 
-    validate(cfg, schema=schema)
+
+_SCHEMA = _build_schema()
+
+
+@lru_cache(maxsize=None)
+def _validator():
+    """
+    Check the schema and compile its validator on first use. jsonschema is
+    imported here so importing sysbuilder doesn't pay for it.
+    """
+
+    # pylint: disable=C0415
+    from jsonschema import Draft202012Validator, FormatChecker
+
+    formats = FormatChecker(formats=())
+    formats.checks("disk-size")(_is_disk_size)
+    formats.checks("file-mode")(_is_file_mode)
+    formats.checks("mountpoint")(_is_mountpoint)
+
+    Draft202012Validator.check_schema(_SCHEMA)
+    return Draft202012Validator(_SCHEMA, format_checker=formats)
+
+
+@lru_cache(maxsize=16)
+def _check_serialized(serialized: str) -> None:
+    """
+    Validate a config serialized with sorted keys. Only configs that pass
+    are remembered; a failing one raises and is checked again next time.
+    """
+
+    from jsonschema.exceptions import best_match  # pylint: disable=C0415
+
+    error = best_match(_validator().iter_errors(json.loads(serialized)))
+    if error is not None:
+        raise error
+
+
+def check(cfg: Dict) -> None:
+    """
+    Check sysbuilder configuration data. The validator is compiled on the
+    first call, and checking the same config again is a cache hit.
+    """
+
+    _check_serialized(json.dumps(cfg, sort_keys=True))
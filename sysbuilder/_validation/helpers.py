@@ -11,7 +11,11 @@ def type_bool() -> Dict:
     return {"type": "boolean"}
 
 
-def type_dict(properties: Dict = None, required: List = None) -> Dict:
+def type_dict(
+    properties: Dict = None,
+    required: List = None,
+    additional_properties: bool | None = None,
+) -> Dict:
     """Object"""
 
     val = {"type": "object"}
@@ -22,12 +26,21 @@ def type_dict(properties: Dict = None, required: List = None) -> Dict:
     if required is not None:
         val["required"] = required
 
+    if additional_properties is not None:
+        val["additionalProperties"] = additional_properties
+
     return val
 
 
-def type_int() -> Dict:
+def type_int(minimum: int | None = None) -> Dict:
     """Integer"""
-    return {"type": "integer"}
+
+    val = {"type": "integer"}
+
+    if minimum is not None:
+        val["minimum"] = minimum
+
+    return val
 
 
 def type_list(
@@ -52,7 +65,10 @@ def type_list(
 
 
 def type_str(
-    enum: List = None, pattern: str = None, or_empty: bool = False
+    enum: List = None,
+    pattern: str = None,
+    or_empty: bool = False,
+    format: str = None,  # pylint: disable=W0622
 ) -> Dict:
     """String"""
 
@@ -66,4 +82,7 @@ def type_str(
     if pattern is not None:
         val["pattern"] = pattern
 
+    if format is not None:
+        val["format"] = format
+
     return val
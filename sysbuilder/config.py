@@ -1,14 +1,37 @@
 """Convert the configuration file into an object."""
 
-import json
 import logging
 import os
-from typing import Any, Dict
-from sysbuilder.shell import Lsblk
-from sysbuilder._validation import config
+import pathlib
+import re
+from functools import lru_cache
+from typing import Any, Dict, Tuple
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 log = logging.getLogger(__name__)
 
+# Partition boundaries as sgdisk takes them: empty, or an optionally signed
+# number of sectors or K/M/G/T/P, in either case.
+_SECTOR_RE = re.compile(r"(?:[+-]?\d+[KMGTPkmgtp]?)?")
+
+_MISSING = object()
+
+
+@lru_cache(maxsize=128)
+def _check_block_device(path: str) -> None:
+    """
+    Raise if lsblk doesn't know `path`. Devices that are found are
+    remembered so validating the same disk again doesn't run lsblk.
+    """
+
+    from sysbuilder.shell import Lsblk  # pylint: disable=C0415
+
+    Lsblk.list_one(path)
+
 
 class Config:
     """
@@ -16,6 +39,20 @@ class Config:
     functional system build.
     """
 
+    __slots__ = ("_cfg",)
+
+    # The `_validate_*` hooks run by `_validate`, in order. Subclasses have
+    # their own hooks appended when they are defined.
+    _VALIDATORS: Tuple[str, ...] = ("_validate_layout", "_validate_storage")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._VALIDATORS += tuple(
+            name
+            for name in sorted(cls.__dict__)
+            if name.startswith("_validate_") and name not in cls._VALIDATORS
+        )
+
     def __init__(self, cfg: dict, check: bool = True):
         """
         Load configuration and validate.
@@ -33,24 +70,39 @@ class Config:
 
     @classmethod
     def from_file(cls, cfg: str):
-        """Load configuration from a file."""
+        """
+        Load configuration from a file. The file is read as bytes in one go
+        and handed straight to the JSON parser, orjson if it's installed.
+        """
 
-        with open(
-            cfg, mode="r", encoding="utf-8"
-        ) as f:  # pylint: disable=C0103
-            return cls(cfg=json.load(f), check=True)
+        return cls(cfg=_json.loads(pathlib.Path(cfg).read_bytes()), check=True)
 
     def _validate(self) -> None:
         """
         Does JSON object validation then runs validation specific to certain
-        values in the dictionary.
+        values in the dictionary. The validation modules are only imported
+        here, so `check=False` never loads them.
         """
 
+        from sysbuilder._validation import config  # pylint: disable=C0415
+
         config.check(self._cfg)
 
-        for function in dir(self):
-            if function.startswith("_validate_"):
-                self.__getattribute__(function)()  # pylint: disable=C2801
+        for name in self._VALIDATORS:
+            getattr(self, name)()
+
+    def _validate_layout(self) -> None:
+        """
+        The JSON itself has been validated.
+
+        Validates that each partition's `start` and `end` are positions sgdisk
+        understands.
+        """
+
+        for part in self._cfg["storage"]["layout"]:
+            for key in ("start", "end"):
+                if _SECTOR_RE.fullmatch(part[key]) is None:
+                    raise ValueError(f"Invalid partition {key}: {part[key]!r}")
 
     def _validate_storage(self) -> None:
         """
@@ -65,15 +117,18 @@ class Config:
         disk["path"] = os.path.abspath(disk["path"])
 
         if disk["type"] in ["physical"]:
-            Lsblk.list_one(disk["path"])  # Raises errors if not real.
+            _check_block_device(disk["path"])  # Raises errors if not real.
         elif disk["type"] in ["sparse", "raw"]:
             if "size" not in disk.keys():
                 raise KeyError("Missing size in disk description.")
 
-    def get(self, key: Any, default: Any = None) -> Dict[Any, Any]:
-        """Get's a configuration value."""
+    def get(self, key: Any, default: Any = _MISSING) -> Dict[Any, Any]:
+        """
+        Get's a configuration value. Raises KeyError for a missing `key`
+        unless a `default` is given.
+        """
 
-        if default is not None:
-            self._cfg.get(key, default)
+        if default is _MISSING:
+            return self._cfg[key]
 
-        return self._cfg[key]
+        return self._cfg.get(key, default)
@@ -4,6 +4,11 @@
 class _SysBuilderError(Exception):
     """Generic sysbuilder exception."""
 
+    def __init__(self, *args):
+        """Without a message, the class docstring is used instead."""
+
+        super().__init__(*(args or (self.__doc__,)))
+
 
 class BlockDeviceExistsError(_SysBuilderError):
     """A loop device exists when it should not."""
@@ -2,18 +2,50 @@
 This module concerns the VDIs that will be created by sysbuilder. 
 """
 
+import errno
 import logging
 import os
+import shlex
+from concurrent.futures import ThreadPoolExecutor
 from shutil import chown, copy, copytree
-from subprocess import CalledProcessError
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 from sysbuilder.config import Config
-from sysbuilder.shell import ArchChroot, Pacstrap
+from sysbuilder.shell import ArchChroot, ArchChrootSession, Pacstrap
 from sysbuilder.storage import Storage
 
 log = logging.getLogger(__name__)
 
 
+def _fast_copy(src: str, dst: str) -> None:
+    """
+    Copy the contents of `src` to `dst` with copy_file_range(2), so the data
+    never passes through userspace and can be reflinked by filesystems that
+    support it. Falls back to `shutil.copy` when the kernel or filesystem
+    can't do it, or when nothing was copied: files such as those in procfs
+    report a size of 0 and copy_file_range copies nothing from them.
+    """
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            copied = 0
+            while chunk := os.copy_file_range(
+                fsrc.fileno(), fdst.fileno(), 2**30
+            ):
+                copied += chunk
+            if copied:
+                return
+        except OSError as e:  # pylint: disable=C0103
+            if e.errno not in [
+                errno.EINVAL,
+                errno.ENOSYS,
+                errno.EOPNOTSUPP,
+                errno.EXDEV,
+            ]:
+                raise
+
+    copy(src=src, dst=dst)
+
+
 class VDI:
     """Virtual Disk Image class."""
 
@@ -40,39 +72,138 @@ class VDI:
         self._install_cfg = self._cfg.get("install")
         self._storage_cfg = self._cfg.get("storage")
 
+        # Catch anything `create` can't handle before storage is touched.
+        if self._install_cfg.get("base") != "archlinux":
+            raise ValueError(
+                "The base install system must be one of the following: ['archlinux']."
+            )
+
+        if self._install_cfg.get("service_manager") != "systemd":
+            raise ValueError(
+                "The process management system must be one of the following: ['systemd']."
+            )
+
+        self._file_specs = self._sort_files(self._install_cfg.get("files", []))
+
         self._storage = Storage(self._storage_cfg)
+        self._session = None
+        self._queued = []
+        self._entries = {}
+
+    @staticmethod
+    def _read_entry(root: str, database: str, key: str) -> Tuple[str, ...]:
+        """
+        Find `key` in the system at `root`'s /etc/`database` (passwd or
+        group) without entering the chroot. Returns the entry split into its
+        fields, or an empty tuple if it isn't there.
+        """
+
+        prefix = f"{key}:"
+        try:
+            with open(
+                os.path.join(root, "etc", database), encoding="utf-8"
+            ) as f:  # pylint: disable=C0103
+                for line in f:
+                    if line.startswith(prefix):
+                        return tuple(line.rstrip("\n").split(":"))
+        except FileNotFoundError:
+            pass
+
+        return ()
+
+    def _getent(
+        self, user: str, group: str
+    ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """
+        Look up `user` in the passwd database and `group` in the group
+        database of the image. Returns both entries split into their fields.
+        /etc/passwd and /etc/group are read straight from the mounted
+        filesystem; getent is only run in the chroot if either name isn't in
+        them (ie, it comes from another NSS source). Lookups are cached until
+        `close`. Not thread safe, as it may use the chroot session.
+        """
+
+        entries = self._entries.get((user, group))
+        if entries is not None:
+            return entries
+
+        root = self._storage.root
+        passwd = VDI._read_entry(root, "passwd", user)
+        group_entry = VDI._read_entry(root, "group", group)
+
+        if not (passwd and group_entry):
+            # Keep anything printed on stderr out of the entries, and pick
+            # them out by name. The passwd entry is printed first, which
+            # matters when the user and group share a name.
+            lines = self._chroot(
+                chroot_command="sh",
+                chroot_command_args=[
+                    "-c",
+                    'getent passwd "$1" 2>/dev/null'
+                    ' && getent group "$2" 2>/dev/null',
+                    "sh",
+                    user,
+                    group,
+                ],
+            ).splitlines()
+            passwd = next(
+                (
+                    tuple(line.split(":"))
+                    for line in lines
+                    if line.startswith(f"{user}:")
+                ),
+                (),
+            )
+            group_entry = next(
+                (
+                    tuple(line.split(":"))
+                    for line in reversed(lines)
+                    if line.startswith(f"{group}:")
+                ),
+                (),
+            )
+            if not (passwd and group_entry):
+                raise ValueError(
+                    f"No passwd entry for {user} or group entry for {group}."
+                )
+
+        self._entries[(user, group)] = passwd, group_entry
+
+        return passwd, group_entry
+
+    def _ids(self, user: str, group: str) -> Tuple[int, int]:
+        """Return the uid of `user` and gid of `group` in the image."""
+
+        passwd, group_entry = self._getent(user, group)
+
+        return int(passwd[2]), int(group_entry[2])
 
     @staticmethod
     def _copy_file(
-        root: str, src: str, dest: str, mode: str, owner: str, group: str
+        root: str,
+        src: str,
+        dest: str,
+        mode: str,
+        vdi_owner_id: int,
+        vdi_group_id: int,
     ):
         """Copy files to vdi"""
 
-        if os.path.abspath(dest):
-            dest = os.path.relpath(dest, "/")
-        dest = os.path.join(root, dest)
-
-        vdi_owner_id = int(
-            ArchChroot.chroot(
-                chroot_dir=root,
-                chroot_command="getent",
-                chroot_command_args=["passwd", owner],
-            ).split(":")[2]
-        )
-
-        vdi_group_id = int(
-            ArchChroot.chroot(
-                chroot_dir=root,
-                chroot_command="getent",
-                chroot_command_args=["group", group],
-            ).split(":")[2]
-        )
+        dest = os.path.join(root, dest.lstrip("/"))
 
-        if not os.path.exists(os.path.dirname(dest)):
+        # Other files may be creating the same directory at the same time.
+        try:
             os.makedirs(os.path.dirname(dest))
-            chown(path=os.path.dirname(dest), user=vdi_owner_id, group=vdi_group_id)
+        except FileExistsError:
+            pass
+        else:
+            chown(
+                path=os.path.dirname(dest),
+                user=vdi_owner_id,
+                group=vdi_group_id,
+            )
 
-        copy(src=src, dst=dest)
+        _fast_copy(src=src, dst=dest)
 
         os.chmod(dest, mode=int(mode, base=8))
 
@@ -80,73 +211,133 @@ class VDI:
 
     @staticmethod
     def _copy_directory(
-        root: str, src: str, dest: str, mode: str, owner: str, group: str
+        root: str,
+        src: str,
+        dest: str,
+        mode: str,
+        vdi_owner_id: int,
+        vdi_group_id: int,
     ):
         """Copy directories to vdi"""
 
-        if os.path.abspath(dest):
-            dest = os.path.relpath(dest, "/")
-        dest = os.path.join(root, dest)
+        dest = os.path.join(root, dest.lstrip("/"))
 
         copytree(src=src, dst=dest)
 
         os.chmod(dest, mode=int(mode, base=8))
 
-        vdi_owner_id = int(
-            ArchChroot.chroot(
-                chroot_dir=root,
-                chroot_command="getent",
-                chroot_command_args=["passwd", owner],
-            ).split(":")[2]
-        )
-
-        vdi_group_id = int(
-            ArchChroot.chroot(
-                chroot_dir=root,
-                chroot_command="getent",
-                chroot_command_args=["group", group],
-            ).split(":")[2]
-        )
-
         chown(path=dest, user=vdi_owner_id, group=vdi_group_id)
 
-    @staticmethod
-    def _create_symlink(root: str, src: str, dest: str):
+    def _create_symlink(self, src: str, dest: str):
         """Create symlinks in the vdi."""
 
-        if os.path.abspath(dest):
-            host_dest = os.path.relpath(dest, "/")
-        host_dest = os.path.join(root, host_dest)
+        host_dest = os.path.join(self._storage.root, dest.lstrip("/"))
+
+        os.makedirs(os.path.dirname(host_dest), exist_ok=True)
+
+        self._queue("ln", ["-s", src, dest])
+
+    def _chroot(
+        self, chroot_command: str, chroot_command_args: List[str] | None = None
+    ) -> str:
+        """
+        Run `chroot_command` with `chroot_command_args` in the image. Goes
+        through the build's chroot session while `create` has one open, and
+        enters the chroot just for this command otherwise. Anything queued
+        runs first.
+        """
+
+        self._flush()
+
+        if self._session is not None:
+            return self._session.run(
+                [chroot_command] + (chroot_command_args or [])
+            )
+
+        return ArchChroot.chroot(
+            chroot_dir=self._storage.root,
+            chroot_command=chroot_command,
+            chroot_command_args=chroot_command_args,
+        )
 
-        os.makedirs(os.path.dirname(host_dest))
+    def _queue(
+        self, chroot_command: str, chroot_command_args: List[str] | None = None
+    ) -> None:
+        """Queue `chroot_command` to run in the image at the next `_flush`."""
 
-        ArchChroot.chroot(
-            chroot_dir=root,
-            chroot_command="ln",
-            chroot_command_args=["-s", src, dest],
+        self._queued.append(
+            shlex.join([chroot_command] + (chroot_command_args or []))
         )
 
+    def _flush(self) -> None:
+        """
+        Run every queued command, in order, as a single script in a single
+        chroot. The script stops at the first command that fails.
+        """
+
+        if self._queued:
+            script, self._queued = self._queued, []
+            self._chroot(
+                chroot_command="sh",
+                chroot_command_args=["-e", "-c", "\n".join(script)],
+            )
+
     def _archlinux_system(self):
         """Install an arch based system."""
 
-        packages = self._install_cfg.get("packages", [])
-        packages.append("base")
+        packages = self._install_cfg.get("packages", []) + ["base"]
 
-        # Archlinux install only supports Pacstrap
-        Pacstrap.install(fs_root=self._storage.root, packages=packages)
+        # Archlinux install only supports Pacstrap. Sharing the host's package
+        # cache means repeated builds don't download everything again.
+        Pacstrap.install(
+            fs_root=self._storage.root, packages=packages, host_cache=True
+        )
 
         # Disable root
         if self._install_cfg.get("disable_root", True):
-            ArchChroot.chroot(
-                self._storage.root,
-                chroot_command="usermod",
-                chroot_command_args=["--lock", "--expiredate", "1", "root"],
-            )
+            self._lock_root()
 
-    def _files(self):
-        """Add files to vdi"""
+    def _lock_root(self):
+        """
+        Lock root's password and expire the account, like
+        `usermod --lock --expiredate 1 root`, by editing the image's
+        /etc/shadow directly instead of entering the chroot.
+        """
+
+        shadow = os.path.join(self._storage.root, "etc", "shadow")
+
+        with open(shadow, encoding="utf-8") as f:
+            entries = f.readlines()
+
+        for index, entry in enumerate(entries):
+            fields = entry.rstrip("\n").split(":")
+            if fields[0] == "root":
+                # A shadow entry has 9 fields; trailing empty ones may be
+                # missing.
+                fields.extend([""] * (9 - len(fields)))
+                if not fields[1].startswith("!"):
+                    fields[1] = f"!{fields[1]}"
+                fields[7] = "1"
+                entries[index] = ":".join(fields) + "\n"
+                break
+        else:
+            raise ValueError(f"root has no entry in {shadow}.")
+
+        with open(shadow, mode="w", encoding="utf-8") as f:
+            f.write("".join(entries))
+
+    @staticmethod
+    def _sort_files(files: List[Dict[str, str]]) -> Tuple[List, List, List]:
+        """
+        Check every `files` entry and split them into directories, regular
+        files and links, each as a list of argument tuples for the method
+        that installs it.
+        """
+
+        directories = []
+        regular_files = []
+        links = []
 
-        files = self._install_cfg.get("files", [])
         for f in files:
             src = f["src"]
             dest = f["dest"]
@@ -166,83 +357,102 @@ class VDI:
                     )
                 if group is None:
                     raise ValueError(
-                        f"'owner' must be a provided key if type is not link!: {f}",
+                        f"'group' must be a provided key if type is not link!: {f}",
                     )
 
             if ftype == "link":
-                self._create_symlink(self._storage.root, src=src, dest=dest)
+                links.append((src, dest))
             if ftype == "directory":
-                self._copy_directory(
-                    self._storage.root,
-                    src=src,
-                    dest=dest,
-                    mode=mode,
-                    owner=owner,
-                    group=group,
-                )
+                directories.append((src, dest, mode, owner, group))
             if ftype == "file":
-                self._copy_file(
-                    self._storage.root,
-                    src=src,
-                    dest=dest,
-                    mode=mode,
-                    owner=owner,
-                    group=group,
-                )
+                regular_files.append((src, dest, mode, owner, group))
+
+        return directories, regular_files, links
+
+    def _files(self):
+        """
+        Add files to vdi. The entries were checked by `__init__`.
+        Directories are copied first, then files (in parallel), then links.
+        """
+
+        directories, regular_files, links = self._file_specs
+
+        # Owners are looked up here, before the copies start, as a lookup may
+        # need the chroot session, which only one thread can use at a time.
+        # Directories go first, in order, so files can be copied into them.
+        # Files don't depend on each other, so they're copied in parallel.
+        for src, dest, mode, owner, group in directories:
+            self._copy_directory(
+                self._storage.root,
+                src,
+                dest,
+                mode,
+                *self._ids(owner, group),
+            )
+
+        files = [
+            (src, dest, mode, *self._ids(owner, group))
+            for src, dest, mode, owner, group in regular_files
+        ]
+        with ThreadPoolExecutor() as pool:
+            futures = [
+                pool.submit(self._copy_file, self._storage.root, *args)
+                for args in files
+            ]
+            for future in futures:
+                future.result()
+
+        for src, dest in links:
+            self._create_symlink(src=src, dest=dest)
 
     def _grub(self):
         """Install grub"""
 
         # TODO: pull target from config
         # TODO: pull efi directory from config
-        ArchChroot.chroot(
-            chroot_dir=self._storage.root,
-            chroot_command="grub-install",
-            chroot_command_args=[
-                "--target=x86_64-efi",
-                "--boot-directory=/boot",
-                "--efi-directory=/efi",
-                self._storage._device.path,  # pylint: disable=W0212
-            ],
+        grub_install = [
+            "grub-install",
+            "--target=x86_64-efi",
+            "--boot-directory=/boot",
+            "--efi-directory=/efi",
+            self._storage._device.path,  # pylint: disable=W0212
+        ]
+
+        # Install grub, write its config and copy it to the default EFI boot
+        # path.
+        self._queue(grub_install[0], grub_install[1:])
+        self._queue("grub-mkconfig", ["-o", "/boot/grub/grub.cfg"])
+        self._queue("mkdir", ["-p", "/efi/EFI/BOOT"])
+        self._queue(
+            "cp",
+            ["/efi/EFI/arch/grubx64.efi", "/efi/EFI/BOOT/BOOTX64.efi"],
         )
 
-        ArchChroot.chroot(
-            chroot_dir=self._storage.root,
-            chroot_command="grub-mkconfig",
-            chroot_command_args=["-o", "/boot/grub/grub.cfg"],
-        )
-
-        # Install grub in a default place.
-        # TODO: pull efi directory from config
-        efi_arch = os.path.join(
-            self._storage.root, "efi", "EFI", "arch", "grubx64.efi"
-        )
-        efi_generic_dir = os.path.join(self._storage.root, "efi", "EFI", "BOOT")
-        efi_generic = os.path.join(efi_generic_dir, "BOOTX64.efi")
-
-        os.makedirs(efi_generic_dir)
-        copy(efi_arch, efi_generic)
-
     def _initramfs(self):
         """
         Recreate initramfs. Run at the end of create automatically incase
         anything has happened that would justify recreating the initram.
+        Images with several kernels are rebuilt from their presets.
         """
 
-        installed_kernel = os.listdir(
+        with os.scandir(
             os.path.join(self._storage.root, "usr", "lib", "modules")
-        )[0]
+        ) as entries:
+            kernels = [entry.name for entry in entries]
 
-        ArchChroot.chroot(
-            chroot_dir=self._storage.root,
-            chroot_command="mkinitcpio",
-            chroot_command_args=[
+        # With more than one kernel installed, let the presets build every
+        # initramfs in one run instead of guessing which kernel is wanted.
+        if len(kernels) > 1:
+            mkinitcpio_args = ["-P"]
+        else:
+            mkinitcpio_args = [
                 "-k",
-                installed_kernel,
+                kernels[0],
                 "-g",
                 "/boot/initramfs-linux.img",
-            ],
-        )
+            ]
+
+        self._queue("mkinitcpio", mkinitcpio_args)
 
     def _locale(self):
         """Set locale information."""
@@ -257,10 +467,9 @@ class VDI:
             mode="a",
             encoding="UTF-8",
         ) as f:
-            for l in locale:
-                f.write(f"{l}\n")
+            f.write("".join(f"{l}\n" for l in locale))
 
-        ArchChroot.chroot(self._storage.root, chroot_command="locale-gen")
+        self._queue("locale-gen")
 
     def _shell_commands(self):
         """
@@ -271,37 +480,22 @@ class VDI:
 
         for command in late_commands:
             cmd = command.split()
-            ArchChroot.chroot(
-                chroot_dir=self._storage.root,
-                chroot_command=cmd[0],
-                chroot_command_args=cmd[1:],
-            )
+            self._queue(cmd[0], cmd[1:])
 
     def _systemd(self):
         """
-        Enable/disable services in a systemd-based system.
+        Enable/disable services in a systemd-based system. Nothing is run if
+        there are no services to change.
         """
 
-        enabled_services = self._install_cfg.get("services").get("enabled")
-        disabled_services = self._install_cfg.get("services").get("disabled")
-
-        if enabled_services is not None:
-            args = ["enable"]
-            args.extend(enabled_services)
-            ArchChroot.chroot(
-                self._storage.root,
-                chroot_command="systemctl",
-                chroot_command_args=args,
-            )
+        services = self._install_cfg.get("services") or {}
+        enabled_services = services.get("enabled") or []
+        disabled_services = services.get("disabled") or []
 
-        if disabled_services is not None:
-            args = ["disable"]
-            args.extend(disabled_services)
-            ArchChroot.chroot(
-                self._storage.root,
-                chroot_command="systemctl",
-                chroot_command_args=args,
-            )
+        if enabled_services:
+            self._queue("systemctl", ["enable"] + enabled_services)
+        if disabled_services:
+            self._queue("systemctl", ["disable"] + disabled_services)
 
     def _timezone(self):
         """Set the timezone."""
@@ -309,11 +503,7 @@ class VDI:
         timezone = self._install_cfg.get("timezone", "UTC")
         timezone_file = f"/usr/share/zoneinfo/{timezone}"
 
-        ArchChroot.chroot(
-            self._storage.root,
-            chroot_command="ln",
-            chroot_command_args=["-s", timezone_file, "/etc/localtime"],
-        )
+        self._queue("ln", ["-s", timezone_file, "/etc/localtime"])
 
     def _users(self):
         """
@@ -334,12 +524,14 @@ class VDI:
         }
 
         users = self._install_cfg.get("users", [default_user])
+        ssh_users = []
 
         for user in users:
             name = user["name"]
             gecos = user.get("gecos", name)
             password = user.get("password")
             group = user.get("group", name)
+            user_id = user.get("user_id")
             service_account = user.get("service_account", False)
             additional_groups = user.get("additional_groups")
             home_dir = user.get("home_dir")
@@ -349,6 +541,8 @@ class VDI:
 
             useradd_args = ["-g", group, "-c", gecos, "-s", shell]
 
+            if user_id is not None:
+                useradd_args.extend(["-u", str(user_id)])
             if home_dir is not None:
                 useradd_args.extend(["-d", home_dir])
             if additional_groups is not None:
@@ -362,81 +556,54 @@ class VDI:
 
             useradd_args.append(name)
 
-            try:
-                # TODO: Make getent command.
-                ArchChroot.chroot(
-                    chroot_dir=self._storage.root,
-                    chroot_command="getent",
-                    chroot_command_args=["group", group],
-                )
-            except CalledProcessError as cpe:
-                if cpe.returncode == 2:
-                    groupadd_args = []
-                    if service_account:
-                        groupadd_args.extend(["--system"])
-                    groupadd_args.append(group)
-
-                    ArchChroot.chroot(
-                        chroot_dir=self._storage.root,
-                        chroot_command="groupadd",
-                        chroot_command_args=groupadd_args,
-                    )
-                else:
-                    raise cpe
+            groupadd_args = ["groupadd", "-f"]
+            if service_account:
+                groupadd_args.append("--system")
+            # A user's own group gets the same id as the user. With -f,
+            # groupadd drops -g if that gid is already taken.
+            if user_id is not None and group == name:
+                groupadd_args.extend(["-g", str(user_id)])
+            groupadd_args.append(group)
 
-            ArchChroot.chroot(
-                chroot_dir=self._storage.root,
-                chroot_command="useradd",
-                chroot_command_args=useradd_args,
-            )
+            self._queue(groupadd_args[0], groupadd_args[1:])
+            self._queue("useradd", useradd_args)
 
             if ssh_keys:
-                home_dir = ArchChroot.chroot(
-                    chroot_dir=self._storage.root,
-                    chroot_command="getent",
-                    chroot_command_args=["passwd", name],
-                ).split(":")[5]
-
-                if os.path.abspath(home_dir):
-                    home_dir = os.path.relpath(home_dir, "/")
-                home_dir = os.path.join(self._storage.root, home_dir)
-
-                os.makedirs(name=os.path.join(home_dir, ".ssh"))
-
-                ssh_keyfile = os.path.join(home_dir, ".ssh", "authorized_keys")
-
-                # TODO: Fix encoding
-                with open(
-                    file=os.path.join(home_dir, ".ssh", "authorized_keys"),
-                    mode="w",
-                    encoding="utf-8",
-                ) as f:
-                    for key in ssh_keys:
-                        f.write(f"{key}\n")
-
-                vdi_owner_id = int(
-                    ArchChroot.chroot(
-                        chroot_dir=self._storage.root,
-                        chroot_command="getent",
-                        chroot_command_args=["passwd", name],
-                    ).split(":")[2]
-                )
+                ssh_users.append((name, group, ssh_keys))
 
-                vdi_group_id = int(
-                    ArchChroot.chroot(
-                        chroot_dir=self._storage.root,
-                        chroot_command="getent",
-                        chroot_command_args=["group", group],
-                    ).split(":")[2]
-                )
+        # `groupadd -f` is a no-op for groups that already exist. The
+        # accounts have to exist before their ssh keys can be installed.
+        self._flush()
 
-                chown(path=ssh_keyfile, user=vdi_owner_id, group=vdi_group_id)
+        for name, group, ssh_keys in ssh_users:
+            passwd, group_entry = self._getent(name, group)
+            home_dir = passwd[5]
 
-                os.chmod(path=ssh_keyfile, mode=0o600)
+            home_dir = os.path.join(self._storage.root, home_dir.lstrip("/"))
+
+            os.makedirs(name=os.path.join(home_dir, ".ssh"), exist_ok=True)
+
+            ssh_keyfile = os.path.join(home_dir, ".ssh", "authorized_keys")
+
+            # TODO: Fix encoding
+            with open(
+                file=os.path.join(home_dir, ".ssh", "authorized_keys"),
+                mode="w",
+                encoding="utf-8",
+            ) as f:
+                f.write("".join(f"{key}\n" for key in ssh_keys))
+
+            vdi_owner_id = int(passwd[2])
+            vdi_group_id = int(group_entry[2])
+
+            chown(path=ssh_keyfile, user=vdi_owner_id, group=vdi_group_id)
+
+            os.chmod(path=ssh_keyfile, mode=0o600)
 
     def close(self):
         """Clean up scratch directories."""
 
+        self._entries.clear()
         self._storage.close()
 
     def create(self):
@@ -445,24 +612,21 @@ class VDI:
         self._storage.format()
         self._storage.mount()
 
-        if self._install_cfg["base"] == "archlinux":
-            self._archlinux_system()
-        else:
-            raise ValueError(
-                "The base install system must be one of the following: ['archlinux']."
-            )
+        self._archlinux_system()
 
-        if self._install_cfg["service_manager"] == "systemd":
+        # The base system exists now, so everything else shares one chroot.
+        self._session = ArchChrootSession(self._storage.root)
+        try:
             self._systemd()
-        else:
-            raise ValueError(
-                "The process management system must be one of the following: ['systemd']."
-            )
-
-        self._locale()
-        self._timezone()
-        self._users()
-        self._files()
-        self._initramfs()
-        self._grub()
-        self._shell_commands()
+            self._locale()
+            self._timezone()
+            self._users()
+            self._files()
+            self._initramfs()
+            self._grub()
+            self._shell_commands()
+            self._flush()
+        finally:
+            self._queued = []
+            self._session.close()
+            self._session = None
@@ -1,14 +1,128 @@
 """Shell commands."""
 
-import json
+import asyncio
+import copy
+import ctypes
+import ctypes.util
+import errno
+import fcntl
 import logging
 import os
+import re
+import shlex
 import stat
+import struct
 import subprocess
-from typing import Any, Dict, List
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Set, Tuple
+from sysbuilder import _loopcache
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 log = logging.getLogger(__name__)
 
+# linux/fs.h
+BLKRRPART = 0x125F
+
+# linux/loop.h
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_SET_DIRECT_IO = 0x4C08
+LOOP_CONFIGURE = 0x4C0A
+LOOP_CTL_GET_FREE = 0x4C82
+LO_FLAGS_PARTSCAN = 8
+LO_FLAGS_DIRECT_IO = 16
+
+# dd's multiplicative suffixes, as far as DD needs to understand them.
+_DD_UNITS = {
+    "": 1,
+    "c": 1,
+    "w": 2,
+    "b": 512,
+    "K": 1024,
+    "M": 1024**2,
+    "G": 1024**3,
+    "T": 1024**4,
+    "kB": 1000,
+    "MB": 1000**2,
+    "GB": 1000**3,
+    "TB": 1000**4,
+}
+_DD_NUMBER_RE = re.compile(r"(\d+)([A-Za-z]*)")
+
+
+@lru_cache(maxsize=None)
+def _libc() -> ctypes.CDLL:
+    """Load the C library, keeping errno for `ctypes.get_errno`."""
+
+    return ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+
+# Already root, so commands don't have to go through sudo.
+_IS_ROOT = os.geteuid() == 0
+
+
+def _privileged(cmd: List[str]) -> List[str]:
+    """
+    Return `cmd` without its leading "sudo" if the process is already root,
+    which saves starting sudo, and a PAM session, for every command.
+    """
+
+    if _IS_ROOT and cmd and cmd[0] == "sudo":
+        return cmd[1:]
+
+    return cmd
+
+
+# Fixed leading arguments of the JSON listing commands.
+_LOSETUP_JSON = ("sudo", "losetup", "--json", "--output-all", "--list")
+_LSBLK_JSON = ("lsblk", "--output-all", "--json")
+
+# Paths _require_blockdev has already found to be block devices.
+_BLOCKDEVS: Set[str] = set()
+
+
+def _require_blockdev(devpath: str) -> str:
+    """
+    Return the absolute path of `devpath`, raising ValueError if it isn't a
+    block device. Paths that are block devices are remembered and not stat'd
+    again until `_forget_blockdevs` is called; anything that removes device
+    nodes, such as detaching loop devices or rereading partition tables,
+    must call it.
+    """
+
+    devpath = os.path.abspath(devpath)
+
+    if devpath not in _BLOCKDEVS:
+        if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
+            raise ValueError(f"{devpath} is not a device file.")
+        _BLOCKDEVS.add(devpath)
+
+    return devpath
+
+
+def _forget_blockdevs() -> None:
+    """Forget the block devices found by `_require_blockdev`."""
+
+    _BLOCKDEVS.clear()
+
+
+def _devices_changed() -> None:
+    """
+    Drop everything cached about block devices: the loop device map, the
+    paths known to be block devices, and lsblk's output. Call it after
+    attaching or detaching loop devices or rereading partition tables.
+    """
+
+    _loopcache.invalidate()
+    _forget_blockdevs()
+    Lsblk.invalidate()
+
 
 class _Shell:
     """Generic _Shell class."""
@@ -19,6 +133,7 @@ class _Shell:
         Run the command `cmd` and return what's printed to stdout.
         """
 
+        cmd = _privileged(cmd)
         log.debug(cmd)
         result = subprocess.run(
             cmd, capture_output=True, check=True, encoding="utf-8"
@@ -26,6 +141,86 @@ class _Shell:
 
         return result.stdout
 
+    @staticmethod
+    def run_silent(cmd: List["str"]) -> None:
+        """
+        Run the command `cmd` for its effect only. stdout is discarded rather
+        than captured; stderr is kept for the `subprocess.CalledProcessError`
+        raised on a nonzero exit.
+        """
+
+        cmd = _privileged(cmd)
+        log.debug(cmd)
+        subprocess.run(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=True,
+            encoding="utf-8",
+        )
+
+    @staticmethod
+    def run_json(cmd: List["str"]) -> Any:
+        """
+        Run the command `cmd` and parse what's printed to stdout as JSON.
+
+        The output is kept as bytes and handed straight to the JSON parser,
+        orjson if it's installed, which does its own UTF-8 decoding.
+        """
+
+        cmd = _privileged(cmd)
+        log.debug(cmd)
+        result = subprocess.run(cmd, capture_output=True, check=True)
+
+        return _json.loads(result.stdout)
+
+    @staticmethod
+    async def run_async(cmd: List["str"]) -> str:
+        """
+        Run the command `cmd` without blocking the event loop and return
+        what's printed to stdout. Raises `subprocess.CalledProcessError` on a
+        nonzero exit, like `run`.
+        """
+
+        cmd = _privileged(cmd)
+        log.debug(cmd)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            # Don't leave the command running, or unreaped, when another
+            # command gathered with this one fails.
+            if proc.returncode is None:
+                proc.terminate()
+            await proc.wait()
+            raise
+
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(
+                proc.returncode,
+                cmd,
+                output=stdout.decode("utf-8"),
+                stderr=stderr.decode("utf-8"),
+            )
+
+        return stdout.decode("utf-8")
+
+    @staticmethod
+    def gather(*coros) -> List[Any]:
+        """
+        Run the coroutines `coros`, such as several `run_async` or
+        `create_async` calls on different devices, concurrently from
+        synchronous code. Returns their results in order and raises the first
+        exception any of them raised.
+        """
+
+        async def _gather() -> List[Any]:
+            return await asyncio.gather(*coros)
+
+        return asyncio.run(_gather())
+
 
 class ArchChroot(_Shell):
     """Wraps arch-chroot."""
@@ -52,22 +247,105 @@ class ArchChroot(_Shell):
         return ArchChroot.run(command)
 
 
+class ArchChrootSession:
+    """
+    A shell kept running inside arch-chroot, so a series of commands pays for
+    entering the chroot once. Use it as a context manager; the shell exits
+    when the block does.
+    """
+
+    _SENTINEL = "__sysbuilder_exit_status__"
+
+    def __init__(self, chroot_dir: str):
+        """
+        Start the shell.
+
+        # Params
+
+          - chroot_dir (str): The root of the system to chroot into.
+        """
+
+        command = _privileged(["sudo", "arch-chroot", chroot_dir, "sh"])
+        log.debug(command)
+
+        self._proc = subprocess.Popen(  # pylint: disable=R1732
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding="utf-8",
+        )
+
+    def __enter__(self) -> "ArchChrootSession":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def run(self, cmd: List[str]) -> str:
+        """
+        Run the command `cmd` in the chroot and return what it printed, stdout
+        and stderr combined. Raises `subprocess.CalledProcessError` on a
+        nonzero exit, like `_Shell.run`. The command's stdin is /dev/null so
+        it can't read the session's input.
+        """
+
+        log.debug(cmd)
+        self._proc.stdin.write(
+            f"{shlex.join(cmd)} </dev/null\n"
+            f"printf '\\n{self._SENTINEL} %d\\n' $?\n"
+        )
+        self._proc.stdin.flush()
+
+        output = []
+        for line in self._proc.stdout:
+            head, found, status = line.partition(self._SENTINEL)
+            if found:
+                # printf put a newline before the sentinel; drop it again.
+                output[-1] = output[-1][:-1]
+                output.append(head)
+                break
+            output.append(line)
+        else:
+            raise subprocess.CalledProcessError(
+                self._proc.wait(), cmd, output="".join(output)
+            )
+
+        if int(status) != 0:
+            raise subprocess.CalledProcessError(
+                int(status), cmd, output="".join(output)
+            )
+
+        return "".join(output)
+
+    def close(self) -> None:
+        """
+        End the shell and wait for arch-chroot to clean up. The shell may
+        already be gone, eg after a failed build, so a broken pipe is ignored
+        rather than hiding the error that ended it.
+        """
+
+        try:
+            self._proc.stdin.close()
+        except OSError as err:
+            log.debug("chroot shell already exited (%s)", err)
+        finally:
+            self._proc.wait()
+            self._proc.stdout.close()
+
+
 class DD(_Shell):
     """Wraps `dd` shell command."""
 
     @staticmethod
-    def write_file(
+    def _command(
         input_file: str,
         output_file: str,
         count: str,
         bs: str = "1M",
         convs: List[str] | None = None,
-    ) -> None:
-        """
-        dd wrapper
-
-        Parameters are mostly based off of defined dd parameters.
-        """
+    ) -> List[str]:
+        """Check `output_file` doesn't exist and build the dd command."""
 
         output_file = os.path.abspath(output_file)
 
@@ -86,7 +364,102 @@ class DD(_Shell):
             conversions = ",".join(convs)
             command.append(f"conv={conversions}")
 
-        DD.run(command)
+        return command
+
+    @staticmethod
+    def _to_bytes(value: str) -> int:
+        """Convert a dd size such as "1M" or "2048" to bytes."""
+
+        match = _DD_NUMBER_RE.fullmatch(value)
+        if match is None or match.group(2) not in _DD_UNITS:
+            raise ValueError(f"Invalid size: {value}.")
+
+        number, unit = match.groups()
+
+        return int(number) * _DD_UNITS[unit]
+
+    @staticmethod
+    def _zero_fill(
+        input_file: str,
+        output_file: str,
+        count: str,
+        bs: str = "1M",
+        convs: List[str] | None = None,
+    ) -> bool:
+        """
+        Make a zero filled `output_file` without running dd, if dd would only
+        copy /dev/zero. With the "sparse" conversion the file is truncated to
+        size, otherwise its blocks are allocated with posix_fallocate, which
+        read back as zeros. Returns False if dd is needed after all, including
+        for sizes `_to_bytes` doesn't understand.
+        """
+
+        convs = convs or []
+        if input_file != "/dev/zero" or not set(convs) <= {
+            "sparse",
+            "fsync",
+            "fdatasync",
+        }:
+            return False
+
+        try:
+            size = DD._to_bytes(bs) * DD._to_bytes(count)
+        except ValueError:
+            return False  # Sizes only dd understands, eg "1KiB" or "2x512".
+
+        fd = os.open(
+            os.path.abspath(output_file), os.O_WRONLY | os.O_CREAT | os.O_EXCL
+        )
+        try:
+            if "sparse" in convs:
+                os.ftruncate(fd, size)
+            elif size > 0:
+                os.posix_fallocate(fd, 0, size)
+            if "fsync" in convs or "fdatasync" in convs:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        return True
+
+    @staticmethod
+    def write_file(
+        input_file: str,
+        output_file: str,
+        count: str,
+        bs: str = "1M",
+        convs: List[str] | None = None,
+    ) -> None:
+        """
+        dd wrapper
+
+        Parameters are mostly based off of defined dd parameters. Files
+        filled from /dev/zero are made without running dd, see `_zero_fill`.
+        """
+
+        if DD._zero_fill(input_file, output_file, count, bs, convs):
+            return
+
+        DD.run_silent(DD._command(input_file, output_file, count, bs, convs))
+
+    @staticmethod
+    async def write_file_async(
+        input_file: str,
+        output_file: str,
+        count: str,
+        bs: str = "1M",
+        convs: List[str] | None = None,
+    ) -> None:
+        """
+        Async dd wrapper, usage is identical to `write_file()`.
+        """
+
+        if DD._zero_fill(input_file, output_file, count, bs, convs):
+            return
+
+        await DD.run_async(
+            DD._command(input_file, output_file, count, bs, convs)
+        )
 
 
 class Losetup(_Shell):
@@ -114,11 +487,33 @@ class Losetup(_Shell):
         if stat.S_ISBLK(os.stat(fp).st_mode) > 0:
             raise ValueError(f"{fp} is not a device file.")
 
+        loopdev = _loopcache.get_loop_for(fp)
+        if loopdev is not None:
+            log.debug("%s is already attached to %s", fp, loopdev)
+            return
+
+        try:
+            loopdev = Losetup._configure(fp)
+            _devices_changed()
+            log.debug("%s created successfully", loopdev)
+            return
+        except OSError as err:
+            if err.errno not in [
+                errno.EACCES,
+                errno.EINVAL,
+                errno.ENOENT,
+                errno.ENOTTY,
+                errno.EPERM,
+            ]:
+                raise
+            log.debug("LOOP_CONFIGURE unavailable (%s), using losetup", err)
+
         args = [
             "--show",
             "--find",
             "--nooverlap",
             "--partscan",
+            "--direct-io=on",
         ]
 
         command = ["sudo", "losetup"]
@@ -126,9 +521,112 @@ class Losetup(_Shell):
         command.append(fp)
 
         output = Losetup.run(command)
+        _devices_changed()
 
         log.debug("%s created successfully", output)
 
+    @staticmethod
+    def _loop_info(fp: str, flags: int) -> bytes:
+        """Pack a struct loop_info64 for the backing file `fp`."""
+
+        return struct.pack(
+            "=5Q4I64s64s32s2Q",
+            0,
+            0,
+            0,
+            0,  # lo_offset
+            0,  # lo_sizelimit
+            0,
+            0,
+            0,
+            flags,
+            os.fsencode(fp)[:63],
+            b"",
+            b"",
+            0,
+            0,
+        )
+
+    @staticmethod
+    def _configure(fp: str) -> str:
+        """
+        Attach `fp` to a free loop device with the LOOP_CONFIGURE ioctl
+        (Linux 5.8+), which binds the backing file and sets the loop flags in
+        a single call. Partition scanning and direct I/O are enabled; with
+        direct I/O the backing file's data isn't cached a second time in the
+        page cache. Older kernels get the same result from `_set_fd`. Returns
+        the loop device path.
+
+        Raises `OSError` if the ioctls aren't supported or the caller isn't
+        privileged enough to use /dev/loop-control.
+        """
+
+        backing_fd = os.open(fp, os.O_RDWR | os.O_CLOEXEC)
+
+        try:
+            ctl_fd = os.open("/dev/loop-control", os.O_RDWR | os.O_CLOEXEC)
+
+            try:
+                while True:
+                    index = fcntl.ioctl(ctl_fd, LOOP_CTL_GET_FREE)
+                    loopdev = f"/dev/loop{index}"
+
+                    loop_info = Losetup._loop_info(
+                        fp, LO_FLAGS_PARTSCAN | LO_FLAGS_DIRECT_IO
+                    )
+                    loop_config = (
+                        struct.pack("=2I", backing_fd, 0)
+                        + loop_info
+                        + bytes(64)
+                    )
+
+                    loop_fd = os.open(loopdev, os.O_RDWR | os.O_CLOEXEC)
+                    try:
+                        try:
+                            fcntl.ioctl(loop_fd, LOOP_CONFIGURE, loop_config)
+                        except OSError as err:
+                            if err.errno not in [errno.EINVAL, errno.ENOTTY]:
+                                raise
+                            Losetup._set_fd(loop_fd, backing_fd, fp)
+                        return loopdev
+                    except OSError as err:
+                        # Another process claimed the device first, try again.
+                        if err.errno != errno.EBUSY:
+                            raise
+                    finally:
+                        os.close(loop_fd)
+            finally:
+                os.close(ctl_fd)
+        finally:
+            os.close(backing_fd)
+
+    @staticmethod
+    def _set_fd(loop_fd: int, backing_fd: int, fp: str) -> None:
+        """
+        Bind `backing_fd` to the loop device `loop_fd` the way losetup does on
+        kernels without LOOP_CONFIGURE: LOOP_SET_FD, then LOOP_SET_STATUS64
+        for partition scanning, then LOOP_SET_DIRECT_IO. Direct I/O is best
+        effort, as with `losetup --direct-io`. The device is released again if
+        its status can't be set.
+        """
+
+        fcntl.ioctl(loop_fd, LOOP_SET_FD, backing_fd)
+
+        try:
+            fcntl.ioctl(
+                loop_fd,
+                LOOP_SET_STATUS64,
+                Losetup._loop_info(fp, LO_FLAGS_PARTSCAN),
+            )
+        except OSError:
+            fcntl.ioctl(loop_fd, LOOP_CLR_FD)
+            raise
+
+        try:
+            fcntl.ioctl(loop_fd, LOOP_SET_DIRECT_IO, 1)
+        except OSError as err:
+            log.debug("Direct I/O unavailable for %s (%s)", fp, err)
+
     @staticmethod
     def detach(fp: str) -> None:
         """
@@ -141,24 +639,46 @@ class Losetup(_Shell):
           - fp (str): Path to target file.
         """
 
-        fp = os.path.abspath(fp)
+        Losetup.detach_many([fp])
+
+    @staticmethod
+    def detach_many(fps: List[str]) -> None:
+        """
+        Wraps losetup.
+
+        For deactivating several loop devices with one losetup call.
+
+        # Params
+
+          - fps (list): Paths to the loop devices.
+        """
 
-        if stat.S_ISBLK(os.stat(fp).st_mode) == 0:
-            raise ValueError(f"{fp} is a device file already.")
+        if not fps:
+            return
+
+        fps = [_require_blockdev(fp) for fp in fps]
 
         args = ["--detach"]
 
         command = ["sudo", "losetup"]
         command.extend(args)
-        command.append(fp)
+        command.extend(fps)
 
-        Losetup.run(command)
+        Losetup.run_silent(command)
+        _devices_changed()
 
-        try:
-            Lsblk.list_one(fp)
-            raise FileExistsError(fp)
-        except subprocess.CalledProcessError:
-            log.debug("%s removed successfully", fp)
+        # A loop device only has a backing file in sysfs while attached.
+        remaining = [
+            fp
+            for fp in fps
+            if os.path.exists(
+                f"/sys/block/{os.path.basename(fp)}/loop/backing_file"
+            )
+        ]
+        if remaining:
+            raise FileExistsError(", ".join(remaining))
+
+        log.debug("%s removed successfully", ", ".join(fps))
 
     @staticmethod
     def detach_all() -> None:
@@ -173,7 +693,8 @@ class Losetup(_Shell):
         command = ["sudo", "losetup"]
         command.extend(args)
 
-        Losetup.run(command)
+        Losetup.run_silent(command)
+        _devices_changed()
 
     @staticmethod
     def identify(fp: str) -> str:
@@ -188,6 +709,10 @@ class Losetup(_Shell):
         if not os.path.exists(fp):
             raise ValueError(f"{fp} does not exist!")
 
+        loopdev = _loopcache.get_loop_for(fp)
+        if loopdev is not None:
+            return loopdev
+
         args = ["--find", "--show", "--nooverlap"]
 
         command = ["sudo", "losetup"]
@@ -195,6 +720,7 @@ class Losetup(_Shell):
         command.append(fp)
 
         output = Losetup.run(command)
+        _devices_changed()
 
         return output.strip()
 
@@ -204,50 +730,99 @@ class Losetup(_Shell):
         Gets details for a loop device `devpath`.
         """
 
-        devpath = os.path.abspath(devpath)
+        devpath = _require_blockdev(devpath)
 
-        if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-            raise ValueError(f"{devpath} is not a device file.")
+        loopdevices = Losetup.run_json([*_LOSETUP_JSON, devpath])
 
-        args = ["--json", "--output-all", "--list"]
+        return loopdevices
 
-        command = ["sudo", "losetup"]
-        command.extend(args)
-        command.append(devpath)
+    @staticmethod
+    def list_many(devpaths: List[str]) -> Dict[str, List[Dict[Any, Any]]]:
+        """
+        Gets details for loop devices `devpaths`.
+        """
 
-        output = Losetup.run(command)
+        devpaths = [_require_blockdev(devpath) for devpath in devpaths]
 
-        loopdevices = json.loads(output)
+        loopdevices = Losetup.run_json([*_LOSETUP_JSON, *devpaths])
 
         return loopdevices
 
     @staticmethod
-    def list_many(devpaths: List[str]) -> Dict[str, List[Dict[Any, Any]]]:
+    def snapshot() -> Dict[str, Dict[Any, Any]]:
         """
-        Gets details for loop devices `devpaths`.
+        Gets details for every loop device with one losetup call, keyed by
+        device path, so callers looking at several devices can index into it
+        instead of running `list_one` for each.
         """
 
-        for index, devpath in enumerate(devpaths):
-            devpaths[index] = devpath = os.path.abspath(devpath)
+        loopdevices = Losetup.run_json(list(_LOSETUP_JSON))["loopdevices"]
 
-            if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-                raise ValueError(f"{devpath} is not a device file.")
+        return {loopdev["name"]: loopdev for loopdev in loopdevices}
 
-        args = ["--json", "--output-all", "--list"]
 
-        command = ["sudo", "losetup"]
-        command.extend(args)
-        command.extend(devpaths)
+class Lsblk(_Shell):
+    """
+    Wraps `lsblk` shell command.
 
-        output = Losetup.run(command)
+    The JSON returned by `list_all`, `list_one`, and `list_multiple` is cached
+    per command line and reused until `invalidate` is called. Every wrapper
+    in this module that changes block devices, partitions, filesystems, or
+    mounts calls it; anything else that does must call it too. Callers get
+    their own copy of the cached JSON and may modify it.
 
-        loopdevices = json.loads(output)
+    lsblk gets filesystem types, labels, and UUIDs from udev, which updates
+    them asynchronously, so the first lookup after an invalidation waits for
+    udev to settle before anything is cached.
+    """
 
-        return loopdevices
+    _cache: Dict[Tuple[str, ...], Any] = {}
+    _cache_generation = 0
+    _settled_generation = 0
+    _cache_lock = threading.Lock()
 
+    @staticmethod
+    def invalidate() -> None:
+        """Drop the cached lsblk output after changing block devices."""
 
-class Lsblk(_Shell):
-    """Wraps `lsblk` shell command."""
+        with Lsblk._cache_lock:
+            Lsblk._cache.clear()
+            Lsblk._cache_generation += 1
+
+    @staticmethod
+    def _settle() -> None:
+        """
+        Wait for udev to finish processing device events. Skipped if udevadm
+        isn't available or udev doesn't settle in time.
+        """
+
+        try:
+            Lsblk.run_silent(["udevadm", "settle"])
+        except (FileNotFoundError, subprocess.CalledProcessError) as err:
+            log.debug("udevadm settle failed (%s)", err)
+
+    @staticmethod
+    def _cached_json(command: Tuple[str, ...]) -> Any:
+        """
+        Return `run_json(command)`, reusing the cached result if any. The
+        command is a tuple so it can be the cache key as is.
+        """
+
+        with Lsblk._cache_lock:
+            output = Lsblk._cache.get(command)
+            generation = Lsblk._cache_generation
+
+        if output is None:
+            if generation != Lsblk._settled_generation:
+                Lsblk._settle()
+                Lsblk._settled_generation = generation
+            output = Lsblk.run_json(list(command))
+            with Lsblk._cache_lock:
+                # Don't keep output that was invalidated while lsblk ran.
+                if generation == Lsblk._cache_generation:
+                    Lsblk._cache[command] = output
+
+        return copy.deepcopy(output)
 
     @staticmethod
     def list_all() -> Dict[str, List[Dict[Any, Any]]]:
@@ -255,9 +830,7 @@ class Lsblk(_Shell):
         Get details about all block devices.
         """
 
-        command = ["lsblk", "--output-all", "--json"]
-        output = Lsblk.run(command)
-        return json.loads(output)
+        return Lsblk._cached_json(_LSBLK_JSON)
 
     @staticmethod
     def list_one(devpath: str) -> Dict[str, List[Dict[Any, Any]]]:
@@ -265,32 +838,60 @@ class Lsblk(_Shell):
         Get details about the block device `devpath`.
         """
 
-        if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-            raise ValueError(f"{devpath} is not a device file.")
+        devpath = _require_blockdev(devpath)
+
+        return Lsblk._cached_json((*_LSBLK_JSON, devpath))
+
+    @staticmethod
+    def fstype(devpath: str) -> str | None:
+        """
+        Get the filesystem type on the block device `devpath`, or None if it
+        has none. Only that one column is requested, so lsblk doesn't have to
+        gather every other detail about the device.
+        """
+
+        devpath = _require_blockdev(devpath)
 
-        command = ["lsblk", "--output-all", "--json"]
+        command = ["lsblk", "--nodeps", "--noheadings", "--output", "FSTYPE"]
         command.append(devpath)
 
-        output = Lsblk.run(command)
+        output = Lsblk.run(command).strip()
 
-        return json.loads(output)
+        return output or None
 
     @staticmethod
-    def list_multiple(devpaths: List[str]) -> Dict[str, List[Dict[Any, Any]]]:
+    def list_partitions(devpath: str) -> List[str]:
         """
-        Get details about the block devices in `devpaths`.
+        Get the device paths of the partitions on the block device `devpath`.
+
+        Only the name and type columns are requested, one device per line
+        without headings, so there's no JSON to parse.
         """
 
-        for devpath in devpaths:
-            if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-                raise ValueError(f"{devpath} is not a device file.")
+        devpath = _require_blockdev(devpath)
 
-        command = ["lsblk", "--output-all", "--json"]
-        command.extend(devpaths)
+        command = ["lsblk", "--list", "--noheadings", "--output", "NAME,TYPE"]
+        command.append(devpath)
 
         output = Lsblk.run(command)
 
-        return json.loads(output)
+        partitions = []
+        for line in output.splitlines():
+            name, devtype = line.split()
+            if devtype == "part":
+                partitions.append(f"/dev/{name}")
+
+        return partitions
+
+    @staticmethod
+    def list_multiple(devpaths: List[str]) -> Dict[str, List[Dict[Any, Any]]]:
+        """
+        Get details about the block devices in `devpaths`.
+        """
+
+        devpaths = [_require_blockdev(devpath) for devpath in devpaths]
+
+        return Lsblk._cached_json((*_LSBLK_JSON, *devpaths))
 
 
 class Mkfs(_Shell):
@@ -298,6 +899,32 @@ class Mkfs(_Shell):
     mkfs wrapper
     """
 
+    @staticmethod
+    def _command(
+        devpath: str,
+        fstype: str,
+        fs_label: str | None = None,
+        fs_label_flag: str = "-L",
+        fs_args: List[str] | None = None,
+    ) -> List[str]:
+        """Check `devpath` is unformatted and build the mkfs command."""
+
+        existing = Lsblk.fstype(devpath)
+
+        if existing is not None:
+            raise FileExistsError(f"{existing} detected on {devpath}!")
+
+        command = ["sudo", "mkfs", "--type", fstype]
+
+        if fs_label is not None:
+            command.extend([fs_label_flag, fs_label])
+        if fs_args is not None:
+            command.extend(fs_args)
+
+        command.append(devpath)
+
+        return command
+
     @staticmethod
     def create(
         devpath: str,
@@ -310,28 +937,58 @@ class Mkfs(_Shell):
         mkfs wrapper
         """
 
-        lsblk = Lsblk.list_one(devpath)
-        blockdev = lsblk["blockdevices"][0]  # Block device check
-
-        if blockdev["fstype"] is not None:
-            raise FileExistsError(
-                f"{blockdev['fstype']} detected on {devpath}!"
-            )
-
-        args = ["--type", fstype]
-        args.extend([] if fs_label is None else [fs_label_flag, fs_label])
-        args.extend([] if fs_args is None else fs_args)
+        Mkfs.run_silent(
+            Mkfs._command(devpath, fstype, fs_label, fs_label_flag, fs_args)
+        )
+        Lsblk.invalidate()
 
-        command = ["sudo", "mkfs"]
-        command.extend(args)
-        command.append(devpath)
+    @staticmethod
+    async def create_async(
+        devpath: str,
+        fstype: str,
+        fs_label: str | None = None,
+        fs_label_flag: str = "-L",
+        fs_args: List[str] | None = None,
+    ) -> None:
+        """
+        Async mkfs wrapper, usage is identical to `create()`.
+        """
 
-        Mkfs.run(command)
+        # The precheck runs lsblk, so keep it off the event loop.
+        command = await asyncio.to_thread(
+            Mkfs._command, devpath, fstype, fs_label, fs_label_flag, fs_args
+        )
+        await Mkfs.run_async(command)
+        Lsblk.invalidate()
 
 
 class Mkswap(_Shell):
     """mkswap wrapper"""
 
+    @staticmethod
+    def _command(
+        devpath: str,
+        fs_label: str | None = None,
+        fs_args: List[str] | None = None,
+    ) -> List[str]:
+        """Check `devpath` is unformatted and build the mkswap command."""
+
+        existing = Lsblk.fstype(devpath)
+
+        if existing is not None:
+            raise FileExistsError(f"{existing} detected on {devpath}!")
+
+        command = ["sudo", "mkswap"]
+
+        if fs_label is not None:
+            command.extend(["-L", fs_label])
+        if fs_args is not None:
+            command.extend(fs_args)
+
+        command.append(devpath)
+
+        return command
+
     @staticmethod
     def create(
         devpath: str,
@@ -344,24 +1001,27 @@ class Mkswap(_Shell):
         Usage is nearly identical to `shell.Mkfs.create()`.
         """
 
-        lsblk = Lsblk.list_one(devpath)
-        blockdev = lsblk["blockdevices"][0]  # Block device check
-
-        if blockdev["fstype"] is not None:
-            raise FileExistsError(
-                f"{blockdev['fstype']} detected on {devpath}!"
-            )
-
-        command = ["sudo", "mkswap"]
+        Mkswap.run_silent(Mkswap._command(devpath, fs_label, fs_args))
+        Lsblk.invalidate()
 
-        args = []
-        args.extend([] if fs_label is None else ["-L", fs_label])
-        args.extend([] if fs_args is None else fs_args)
+    @staticmethod
+    async def create_async(
+        devpath: str,
+        fs_label: str | None = None,
+        fs_args: List[str] | None = None,
+    ):
+        """
+        Make a swap area without blocking the event loop.
 
-        command.extend(args)
-        command.append(devpath)
+        Usage is identical to `create()`.
+        """
 
-        Mkswap.run(command)
+        # The precheck runs lsblk, so keep it off the event loop.
+        command = await asyncio.to_thread(
+            Mkswap._command, devpath, fs_label, fs_args
+        )
+        await Mkswap.run_async(command)
+        Lsblk.invalidate()
 
 
 class Mount(_Shell):
@@ -377,29 +1037,83 @@ class Mount(_Shell):
 
         args = [source, target]
         if options is not None:
-            args.extend({"-o", ",".join(options)})
+            args.extend(["-o", ",".join(options)])
 
         command.extend(args)
 
-        Mount.run(command)
+        Mount.run_silent(command)
+        Lsblk.invalidate()
 
     @staticmethod
     def mount(
         devpath: str,
         mountpoint: str,
         options: List[str] | None = None,
+        fstype: str | None = None,
     ) -> None:
-        """Mount `devpath` of type `fstype` at `mountpoint` with `options`."""
+        """
+        Mount `devpath` of type `fstype` at `mountpoint` with `options`.
+
+        When the process is root and `fstype` is known, and no `options` are
+        given, the filesystem is mounted with `mount_syscall` instead of
+        starting mount. mount is still used if that fails.
+        """
+
+        if _IS_ROOT and fstype is not None and options is None:
+            try:
+                Mount.mount_syscall(devpath, mountpoint, fstype)
+                return
+            except OSError as err:
+                log.debug("mount(2) failed (%s), using mount", err)
 
         command = ["mount"]
 
         args = [devpath, mountpoint]
         if options is not None:
-            args.extend({"-o", ",".join(options)})
+            args.extend(["-o", ",".join(options)])
 
         command.extend(args)
 
-        Mount.run(command)
+        Mount.run_silent(command)
+        Lsblk.invalidate()
+
+    @staticmethod
+    def mount_syscall(
+        devpath: str,
+        mountpoint: str,
+        fstype: str,
+        flags: int = 0,
+        data: str | None = None,
+    ) -> None:
+        """
+        Mount `devpath` of type `fstype` at `mountpoint` by calling mount(2)
+        directly. Requires root.
+
+        # Params
+
+          - devpath (str): Path to the device.
+          - mountpoint (str): Directory to mount the filesystem on.
+          - fstype (str): The filesystem type, e.g. "ext4" or "vfat".
+          - flags (int): MS_* mount flags.
+          - data (str): Filesystem specific options, comma separated.
+
+        Raises `OSError` if the kernel refuses the mount.
+        """
+
+        log.debug("mount(%s, %s, %s)", devpath, mountpoint, fstype)
+        result = _libc().mount(
+            os.fsencode(devpath),
+            os.fsencode(mountpoint),
+            fstype.encode(),
+            ctypes.c_ulong(flags),
+            None if data is None else data.encode(),
+        )
+
+        if result != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), devpath)
+
+        Lsblk.invalidate()
 
     @staticmethod
     def list_all() -> List[Dict[str, str]]:
@@ -410,17 +1124,25 @@ class Pacstrap(_Shell):
     """Wrap pacstrap."""
 
     @staticmethod
-    def install(fs_root: str, packages: List[str]) -> None:
-        """Install packages to the filesystem at `fs_root`."""
+    def install(
+        fs_root: str, packages: List[str], host_cache: bool = False
+    ) -> None:
+        """
+        Install packages to the filesystem at `fs_root`. If `host_cache` is
+        true packages are downloaded to, and reused from, the host's pacman
+        cache instead of a fresh cache inside `fs_root`.
+        """
 
         command = ["pacstrap", "-K", "-M"]
+        if host_cache:
+            command.append("-c")
 
         args = [fs_root]
         args.extend(packages)
 
         command.extend(args)
 
-        Pacstrap.run(command)
+        Pacstrap.run_silent(command)
 
 
 class PartProbe(_Shell):
@@ -428,15 +1150,41 @@ class PartProbe(_Shell):
 
     @staticmethod
     def probe_device(devpath: str):
-        """Probes a device `devpath` for partitions."""
+        """
+        Probes a device `devpath` for partitions.
 
-        if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-            raise ValueError(f"{devpath} is not a device file.")
+        The kernel is asked to reread the partition table with the BLKRRPART
+        ioctl. partprobe is only run if that isn't allowed, or if the device
+        is busy, which partprobe can work around by updating partitions one
+        at a time.
+        """
 
-        command = ["sudo", "partprobe"]
-        command.append(devpath)
+        devpath = _require_blockdev(devpath)
 
-        PartProbe.run(command)
+        try:
+            fd = os.open(devpath, os.O_RDONLY | os.O_CLOEXEC)
+            try:
+                fcntl.ioctl(fd, BLKRRPART)
+            finally:
+                os.close(fd)
+        except OSError as err:
+            if err.errno not in [
+                errno.EACCES,
+                errno.EBUSY,
+                errno.EINVAL,
+                errno.ENOTTY,
+                errno.EPERM,
+            ]:
+                raise
+            log.debug(
+                "BLKRRPART failed on %s (%s), using partprobe", devpath, err
+            )
+
+            command = ["sudo", "partprobe"]
+            command.append(devpath)
+
+            PartProbe.run_silent(command)
+        _devices_changed()
 
 
 class SGDisk(_Shell):
@@ -448,9 +1196,11 @@ class SGDisk(_Shell):
         part_number: str,
         start_sector: str = "",
         end_sector: str = "",
+        typecode: str | None = None,
     ) -> None:
         """
-        Use sgdisk to create a partition.
+        Use sgdisk to create a partition. If `typecode` is provided it is
+        assigned by the same sgdisk call.
 
         # Params
 
@@ -464,22 +1214,59 @@ class SGDisk(_Shell):
           - end_sector (str): The on-disk sector a partition should end at.
             This can be an absolute sector number or a relative value measured
             in kibibytes, mebibytes, gibibytes, tebibytes, or prebibytes.
+          - typecode (str): A 4-character hexadecimal value representing
+            filesystem type codes.
         """
 
-        if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-            raise ValueError(f"{devpath} is not a device file.")
+        SGDisk.apply_layout(
+            devpath=devpath,
+            partitions=[
+                {
+                    "start": start_sector,
+                    "end": end_sector,
+                    "typecode": typecode,
+                }
+            ],
+            first_part_number=int(part_number),
+        )
+
+    @staticmethod
+    def apply_layout(
+        devpath: str,
+        partitions: List[Dict[str, str | None]],
+        first_part_number: int = 1,
+    ) -> None:
+        """
+        Use a single sgdisk call to create several partitions and assign
+        their typecodes.
+
+        # Params
+
+          - devpath (str): Path to the device.
+          - partitions (list): One dictionary per partition, in order, with
+            the keys "start" and "end" (see `create_partition`) and
+            optionally "typecode".
+          - first_part_number (int): The partition number given to the first
+            item in `partitions`; the rest are numbered after it.
+        """
+
+        devpath = _require_blockdev(devpath)
 
         command = ["sudo", "sgdisk"]
 
-        args = [
-            "--new",
-            ":".join([part_number, str(start_sector), str(end_sector)]),
-        ]
+        for part_number, part in enumerate(partitions, first_part_number):
+            command.extend(
+                ["--new", f"{part_number}:{part['start']}:{part['end']}"]
+            )
+            if part.get("typecode") is not None:
+                command.extend(
+                    ["--typecode", f"{part_number}:{part['typecode']}"]
+                )
 
-        command.extend(args)
         command.append(devpath)
 
-        SGDisk.run(command)
+        SGDisk.run_silent(command)
+        Lsblk.invalidate()
 
     @staticmethod
     def set_partition_type(
@@ -497,20 +1284,18 @@ class SGDisk(_Shell):
             filesystem type codes.
         """
 
-        if stat.S_ISBLK(os.stat(devpath).st_mode) == 0:
-            raise ValueError(f"{devpath} is not a device file.")
-
-        command = ["sudo", "sgdisk"]
+        devpath = _require_blockdev(devpath)
 
-        args = [
+        command = [
+            "sudo",
+            "sgdisk",
             "--typecode",
-            ":".join([part_number, typecode]),
+            f"{part_number}:{typecode}",
+            devpath,
         ]
 
-        command.extend(args)
-        command.append(devpath)
-
-        SGDisk.run(command)
+        SGDisk.run_silent(command)
+        Lsblk.invalidate()
 
 
 class Umount(_Shell):
@@ -520,4 +1305,5 @@ class Umount(_Shell):
     def umount(mountpoint: str) -> None:
         """Unmount `mountpoint`."""
 
-        Umount.run(["sudo", "umount", mountpoint])
+        Umount.run_silent(["sudo", "umount", mountpoint])
+        Lsblk.invalidate()
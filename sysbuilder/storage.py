@@ -9,13 +9,14 @@ classes largely based on kind of file being manipulated. The public classes
 are object-oriented, and call the protected classes as needed.
 """
 
+import asyncio
 import logging
 import os
+import re
 import time
 import tempfile
 from typing import Any, Dict, List, Tuple
 from sysbuilder.shell import (
-    DD,
     Lsblk,
     Losetup,
     Mkfs,
@@ -29,6 +30,51 @@ from sysbuilder.exceptions import BlockDeviceError, LoopDeviceNotFoundError
 
 log = logging.getLogger(__name__)
 
+_SIZE_RE = re.compile(r"(\d+)([KMGTP]?)", re.IGNORECASE)
+_SIZE_UNITS = {
+    "": 1,
+    "K": 1024,
+    "M": 1024**2,
+    "G": 1024**3,
+    "T": 1024**4,
+    "P": 1024**5,
+}
+
+
+def _size_to_bytes(size: str) -> int:
+    """Convert a size in standard notation ("32G", "512M") to bytes."""
+
+    match = _SIZE_RE.fullmatch(size)
+    if match is None:
+        raise ValueError(f"Invalid size: {size}.")
+
+    number, unit = match.groups()
+
+    return int(number) * _SIZE_UNITS[unit.upper()]
+
+
+def _is_blank(devpath: str) -> bool:
+    """
+    Check the start of `devpath` for a partition table: the MBR boot
+    signature, or a GPT header at LBA 1 for 512 or 4096 byte sectors.
+
+    Returns False if the device can't be read, so callers fall back to
+    asking the kernel.
+    """
+
+    try:
+        with open(devpath, mode="rb") as f:  # pylint: disable=C0103
+            header = f.read(4104)
+    except OSError as err:
+        log.debug("Can't read %s (%s), asking lsblk", devpath, err)
+        return False
+
+    return (
+        header[510:512] != b"\x55\xaa"
+        and header[512:520] != b"EFI PART"
+        and header[4096:4104] != b"EFI PART"
+    )
+
 
 class BlockDevice:
     """
@@ -40,6 +86,7 @@ class BlockDevice:
 
         self._data = {}
         self._children = []
+        self._children_view = None
 
     def __eq__(self, other) -> bool:
         """Compare self to other."""
@@ -78,23 +125,17 @@ class BlockDevice:
 
     @classmethod
     def as_image_file(cls, path: str, size: str = "32G"):
-        """Create a block device from an image file."""
-
-        if size.endswith("M") or size.endswith("m"):
-            msize = int(size[:-1])
-        elif size.endswith("G") or size.endswith("g"):
-            msize = int(size[:-1]) * 1024
-        elif size.endswith("T") or size.endswith("t"):
-            msize = int(size[:-1]) * 1024 * 1024
-        elif size.endswith("P") or size.endswith("p"):
-            msize = int(size[:-1]) * 1024 * 1024 * 1024
-
-        DD.write_file(
-            input_file="/dev/zero",
-            output_file=path,
-            count=str(msize),
-            convs=["sparse"],
-        )
+        """
+        Create a block device from an image file. The image is created as a
+        sparse file of `size` bytes, it will only allocate data as it's used.
+        """
+
+        fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_EXCL, 0o644)
+        try:
+            os.ftruncate(fd, _size_to_bytes(size))
+        finally:
+            os.close(fd)
+
         Losetup.attach(path)
         loopdev = Losetup.identify(path)
         blockdev = cls.from_device_path(devpath=loopdev)
@@ -117,7 +158,9 @@ class BlockDevice:
     @property
     def children(self) -> Tuple:
         """Write protect the list of children (the children can still be updated)."""
-        return tuple(self._children)
+        if self._children_view is None:
+            self._children_view = tuple(self._children)
+        return self._children_view
 
     @property
     def devtype(self) -> str:
@@ -165,6 +208,38 @@ class BlockDevice:
 
         self.sync()
 
+    async def add_filesystem_async(
+        self,
+        fs_type: str,
+        fs_label: str | None = None,
+        fs_label_flag: str = "-L",
+        fs_args: List[str] | None = None,
+    ) -> None:
+        """
+        Format partitions without blocking the event loop. Parameters are the
+        same as `add_filesystem`.
+        """
+
+        if self.get("fstype") is not None:
+            raise BlockDeviceError(
+                f"Cannot format a formatted block device: {self.path}."
+            )
+
+        if fs_type == "swap":
+            await Mkswap.create_async(
+                devpath=self.path, fs_label=fs_label, fs_args=fs_args
+            )
+        else:
+            await Mkfs.create_async(
+                devpath=self.path,
+                fstype=fs_type,
+                fs_args=fs_args,
+                fs_label=fs_label,
+                fs_label_flag=fs_label_flag,
+            )
+
+        await asyncio.to_thread(self.sync)
+
     def add_part(  # pylint: disable=R0913
         self,
         start: str,
@@ -292,11 +367,30 @@ class BlockDevice:
             part_number=str(part_number),
             start_sector=start,
             end_sector=end,
+            typecode=typecode,
         )
-        SGDisk.set_partition_type(
+
+        self.probe()
+
+    def insert_partitions(self, partitions: List[Dict[str, str]]) -> None:
+        """
+        Insert several partitions onto a disk after its existing ones, with
+        one sgdisk call and one probe.
+
+        # Params
+
+          - partitions (list): One dictionary per partition, in order, with
+            the keys "start", "end", and "typecode" as described in
+            `insert_partition`. Other keys are ignored.
+        """
+
+        if self.devtype not in ["disk", "loop"]:
+            raise BlockDeviceError("Only disks may be partitioned.")
+
+        SGDisk.apply_layout(
             devpath=self.path,
-            part_number=str(part_number),
-            typecode=typecode,
+            partitions=partitions,
+            first_part_number=len(self._children) + 1,
         )
 
         self.probe()
@@ -381,6 +475,7 @@ class BlockDevice:
                 blockdev = BlockDevice()
                 blockdev.update(incoming_child)
                 self._children.append(blockdev)
+                self._children_view = None
 
 
 class Storage:
@@ -423,33 +518,56 @@ class Storage:
 
     def format(self) -> None:
         """
-        Install partitions and filesystems on empty disks.
-
-        As each partition is created check self._device for all partitions,
-        and configure the first one without a filesystem with the filesystem
-        defined in the layout. As filesystems are being created sequentially
-        to partitions, the first partition without a filesystem should always
-        been the one created previously. Once a filesystem is created mount it
-        as per the layout.
-
-        Admittedly this process is susceptible to race conditions if two (or
-        more) partitions were to be created (nearly) simultaneously. As long
-        as the partitions are created in the order they should be in on the
-        disk they will be processed correctly.
+        Install partitions and filesystems on empty disks. Raises a
+        `BlockDeviceError` if the disk already has partitions.
+
+        Partitions are created by a single sgdisk call, numbered in the order
+        they are listed in the layout, so partition N is always child N of
+        self._device. Once every partition exists their filesystems are
+        created concurrently; each mkfs targets a different partition so the
+        runs are independent of one another. The number of filesystems
+        created at once is capped by the optional storage key
+        `fs_concurrency`, which defaults to the number of partitions or 4,
+        whichever is smaller.
         """
 
-        for part in self._cfg["layout"]:
-            fs_cfg = part["filesystem"]
-
-            self._device.add_part(
-                start=part["start"],
-                end=part["end"],
-                typecode=part["typecode"],
-                fs_type=fs_cfg["type"],
-                fs_args=fs_cfg.get("args"),
-                fs_label=fs_cfg.get("label"),
-                fs_label_flag=fs_cfg.get("label_flag", "-L"),
+        asyncio.run(self._format_async())
+
+    async def _format_async(self) -> None:
+        """Does the work for `format`."""
+
+        layout = self._cfg["layout"]
+
+        if not _is_blank(self._device.path):
+            partitions = Lsblk.list_partitions(self._device.path)
+            if partitions:
+                raise BlockDeviceError(
+                    f"{self._device.path} is already partitioned: {partitions}."
+                )
+
+        self._device.insert_partitions(layout)
+
+        semaphore = asyncio.Semaphore(
+            self._cfg.get("fs_concurrency", min(len(layout), 4))
+        )
+
+        async def create_filesystem(index: int, fs_cfg: Dict) -> None:
+            async with semaphore:
+                await self._device.children[index].add_filesystem_async(
+                    fs_type=fs_cfg["type"],
+                    fs_args=fs_cfg.get("args"),
+                    fs_label=fs_cfg.get("label"),
+                    fs_label_flag=fs_cfg.get("label_flag", "-L"),
+                )
+            log.info("Created filesystem on partition %d", index + 1)
+
+        # Raises the first CalledProcessError from mkfs.
+        await asyncio.gather(
+            *(
+                create_filesystem(index, part["filesystem"])
+                for index, part in enumerate(layout)
             )
+        )
 
     def mount(self) -> None:
         """
@@ -470,6 +588,7 @@ class Storage:
 
         mount_order = []  # Order the mountpoints so they're mounted ccrrectly.
         mount_mapping = {}
+        fstypes = {}
 
         for index, item in enumerate(self._cfg["layout"]):
             mountpoint = item["filesystem"]["mountpoint"]
@@ -490,6 +609,7 @@ class Storage:
 
                 mount_order.append(host_mountpoint)
                 mount_mapping[host_mountpoint] = self._device.children[index]
+                fstypes[host_mountpoint] = item["filesystem"]["type"]
 
                 self._device.children[index].update(
                     attrs={"host_mountpoint": host_mountpoint}
@@ -503,6 +623,10 @@ class Storage:
             if not os.path.exists(mountpoint):
                 os.makedirs(mountpoint)
 
-            Mount.mount(devpath=devpath, mountpoint=mountpoint)
+            Mount.mount(
+                devpath=devpath,
+                mountpoint=mountpoint,
+                fstype=fstypes[mountpoint],
+            )
 
         self._device.sync()
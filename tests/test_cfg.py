@@ -51,3 +51,52 @@ class BadCfgTest(unittest.TestCase):
 
     def test_cfg_bad_layout_incorrect_mountpoint(self):
         self._template("layout_incorrect_mountpoint")
+
+
+class LayoutCfgTest(unittest.TestCase):
+    """Test partition boundary validation."""
+
+    def _config(self, start, end):
+        """Helper."""
+
+        return Config(
+            {"storage": {"layout": [{"start": start, "end": end}]}},
+            check=False,
+        )
+
+    def test_cfg_layout_good(self):
+        """Test accepted partition boundaries."""
+
+        for start, end in [
+            ("", ""),
+            ("", "+4G"),
+            ("2048", "-2G"),
+            ("", "+1P"),
+            ("+1m", "+512m"),
+        ]:
+            cfg = self._config(start, end)
+            cfg._validate_layout()  # pylint: disable=W0212
+
+    def test_cfg_layout_bad(self):
+        """Test rejected partition boundaries."""
+
+        for start, end in [("2X", ""), ("", "4 G"), ("+", "")]:
+            cfg = self._config(start, end)
+            with self.assertRaises(ValueError):
+                cfg._validate_layout()  # pylint: disable=W0212
+
+
+class GetCfgTest(unittest.TestCase):
+    """Test reading configuration values."""
+
+    def test_cfg_get(self):
+        """Test defaults are only used for missing keys."""
+
+        cfg = Config({"install": {}}, check=False)
+
+        self.assertEqual(cfg.get("install"), {})
+        self.assertEqual(cfg.get("install", None), {})
+        self.assertEqual(cfg.get("storage", {"disk": {}}), {"disk": {}})
+        self.assertIsNone(cfg.get("storage", None))
+        with self.assertRaises(KeyError):
+            cfg.get("storage")
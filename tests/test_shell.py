@@ -180,6 +180,54 @@ class DdTest(unittest.TestCase):
 
         self.assertEqual(blocks_utilized * 512, 2147483648)
 
+    def test_dd_size(self):
+        """Test the file size follows dd's bs and count."""
+
+        DD.write_file(
+            input_file="/dev/zero",
+            output_file=self.file,
+            count="3",
+            bs="2kB",
+            convs=["sparse"],
+        )
+
+        self.assertEqual(os.stat(self.file).st_size, 6000)
+
+    def test_dd_size_fallback(self):
+        """Test sizes only dd understands are still accepted."""
+
+        DD.write_file(
+            input_file="/dev/zero",
+            output_file=self.file,
+            count="2x2",
+            bs="1KiB",
+        )
+
+        self.assertEqual(os.stat(self.file).st_size, 4096)
+
+    def test_dd_async(self):
+        """Test files created concurrently."""
+
+        other = os.path.join(os.path.dirname(self.file), "other.img")
+        DD.gather(
+            DD.write_file_async(
+                input_file="/dev/zero",
+                output_file=self.file,
+                count="1",
+                convs=["sparse"],
+            ),
+            DD.write_file_async(
+                input_file="/dev/zero",
+                output_file=other,
+                count="2",
+                convs=["sparse"],
+            ),
+        )
+
+        self.assertEqual(os.stat(self.file).st_size, 1048576)
+        self.assertEqual(os.stat(other).st_size, 2097152)
+        os.remove(other)
+
 
 class FormatDiskTest(unittest.TestCase):
     """Test runs of partprobe."""
@@ -348,6 +396,38 @@ class LosetupTest(unittest.TestCase):
         with self.assertRaises(CalledProcessError):
             Lsblk.list_one(dev)  # The files still exist but lsblk fails.
 
+    def test_losetup_detach_many(self):
+        """Test detaching several loop devices at once"""
+
+        other = os.path.join(tempfile.mkdtemp(), "disk.img")
+        self.addCleanup(rmtree, os.path.dirname(other))
+        DD.write_file(
+            input_file="/dev/zero",
+            output_file=other,
+            count="2048",
+            convs=["sparse"],
+        )
+
+        Losetup.attach(self.file)
+        Losetup.attach(other)
+        devs = [Losetup.identify(self.file), Losetup.identify(other)]
+
+        Losetup.detach_many(devs)
+        for dev in devs:
+            with self.assertRaises(CalledProcessError):
+                Lsblk.list_one(dev)
+
+    def test_losetup_snapshot(self):
+        """Test listing every loop device at once"""
+
+        Losetup.attach(self.file)
+        dev = Losetup.identify(self.file)
+
+        snapshot = Losetup.snapshot()
+        Losetup.detach(dev)
+
+        self.assertEqual(snapshot[dev]["back-file"], self.file)
+
     def test_losetup_identify(self):
         """Test losetup identify"""
 
@@ -394,6 +474,19 @@ class LsblkTest(unittest.TestCase):
                 results = None
                 continue
 
+    def test_lsblk_cache(self):
+        """lsblk output is cached until invalidated and returned as a copy"""
+
+        Lsblk.invalidate()
+        results = Lsblk.list_all()
+        results["blockdevices"].clear()
+
+        self.assertEqual(len(Lsblk._cache), 1)
+        self.assertNotEqual(Lsblk.list_all(), results)
+
+        Lsblk.invalidate()
+        self.assertEqual(len(Lsblk._cache), 0)
+
     def test_lsblk_fail(self):
         """lsblk with one nondevice argument"""
 
@@ -114,6 +114,28 @@ class BlockDeviceTest(unittest.TestCase):
         )
 
 
+class SizeTest(unittest.TestCase):
+    """Test converting sizes in standard notation to bytes."""
+
+    def test_size_to_bytes(self):
+        """Test each unit."""
+
+        self.assertEqual(storage._size_to_bytes("512"), 512)
+        self.assertEqual(storage._size_to_bytes("4K"), 4096)
+        self.assertEqual(storage._size_to_bytes("100M"), 104857600)
+        self.assertEqual(storage._size_to_bytes("32G"), 34359738368)
+        self.assertEqual(storage._size_to_bytes("32g"), 34359738368)
+        self.assertEqual(storage._size_to_bytes("1T"), 1099511627776)
+        self.assertEqual(storage._size_to_bytes("1P"), 1125899906842624)
+
+    def test_size_to_bytes_invalid(self):
+        """Test sizes that aren't in standard notation."""
+
+        for size in ["", "G", "32X", "32GB", "-1G"]:
+            with self.assertRaises(ValueError):
+                storage._size_to_bytes(size)
+
+
 class SparseStorageTesting(unittest.TestCase):
     """Test manipulating sparse disk images."""
 